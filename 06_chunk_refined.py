@@ -1,8 +1,61 @@
 import json
 import re
+import math
+from token_cache import chunk_hash, cache_matches, load_tokenizer, tokenizer_info, load_token_cache, save_token_cache, tokenize_missing
 
-def refine_chunks(input_file, output_file):
-    """Reads marked text and splits it into chunks based on markers."""
+def split_by_token_length(chunk, num_tokens, max_tokens):
+    """Splits a chunk on paragraph (or, failing that, line) boundaries into pieces of roughly max_tokens tokens each."""
+    num_pieces = math.ceil(num_tokens / max_tokens)
+    for separator in ("\n\n", "\n"):
+        parts = [p for p in chunk.split(separator) if p.strip()]
+        if len(parts) >= 2:
+            break
+    if num_pieces <= 1 or len(parts) < 2:
+        return [chunk]
+    # Token counts are only known per chunk, so balance pieces by character share;
+    # the caller re-tokenizes the pieces and splits again any that are still too long
+    target_chars = len(chunk) / num_pieces
+    pieces, current, current_chars = [], [], 0
+    for part in parts:
+        if current and current_chars + len(part) > target_chars:
+            pieces.append(separator.join(current).strip())
+            current, current_chars = [], 0
+        current.append(part)
+        current_chars += len(part) + len(separator)
+    if current:
+        pieces.append(separator.join(current).strip())
+    return [piece for piece in pieces if piece]
+
+def size_chunks(chunks, cache, tokenizer, max_tokens):
+    """Splits chunks longer than max_tokens until every piece fits or cannot be split further.
+
+    All chunks and pieces are tokenized into the cache. Returns (sized chunks, chunks still over the limit).
+    """
+    tokenize_missing(chunks, cache, tokenizer)
+    sized_chunks, over_limit = [], []
+    for chunk in chunks:
+        num_tokens = len(cache[chunk_hash(chunk)])
+        if num_tokens <= max_tokens:
+            sized_chunks.append(chunk)
+            continue
+        pieces = split_by_token_length(chunk, num_tokens, max_tokens)
+        if len(pieces) == 1:
+            sized_chunks.append(chunk)
+            over_limit.append((chunk, num_tokens))
+            continue
+        sub_chunks, sub_over_limit = size_chunks(pieces, cache, tokenizer, max_tokens)
+        sized_chunks.extend(sub_chunks)
+        over_limit.extend(sub_over_limit)
+    return sized_chunks, over_limit
+
+def refine_chunks(input_file, output_file, token_cache_file=None, tokenizer_name=None, cache_dir=None, max_tokens=512):
+    """Reads marked text and splits it into chunks based on markers.
+
+    If a token cache file and tokenizer are given, chunks longer than max_tokens are
+    split further, and the token ids of the final chunks are written to the cache for
+    07_embed_chunks.py. Raw marker-split chunks are kept in the cache too, so reruns
+    on unchanged text tokenize nothing.
+    """
     print(f"--- Starting chunk refinement for {input_file} ---")
     try:
         with open(input_file, "r", encoding="utf-8") as f:
@@ -34,6 +87,46 @@ def refine_chunks(input_file, output_file):
 
     print(f"--- Produced {len(refined_chunks)} refined chunks ---")
 
+    # Split chunks that exceed the embedding model's token limit
+    if token_cache_file and tokenizer_name:
+        try:
+            tokenizer = load_tokenizer(tokenizer_name, cache_dir)
+            print(f"--- Loaded tokenizer: {tokenizer_name} --- (Cache: {cache_dir})")
+        except Exception as e:
+            print(f"Error loading tokenizer {tokenizer_name}, keeping marker chunks: {e}")
+            tokenizer = None
+
+    if token_cache_file and tokenizer_name and tokenizer is not None:
+        try:
+            cache, info = load_token_cache(token_cache_file)
+            if not cache_matches(info, tokenizer_name, tokenizer):
+                print("--- Starting with a fresh token cache ---")
+                cache = {}
+            print(f"--- Loaded {len(cache)} cached tokenizations from {token_cache_file} ---")
+        except Exception as e:
+            print(f"Warning: Could not load token cache {token_cache_file}, starting fresh: {e}")
+            cache = {}
+
+        try:
+            # Never size chunks beyond what the tokenizer's model accepts
+            info = tokenizer_info(tokenizer_name, tokenizer)
+            max_tokens = min(max_tokens, info["model_max_length"])
+            num_cached = len(cache)
+            sized_chunks, over_limit = size_chunks(refined_chunks, cache, tokenizer, max_tokens)
+            print(f"--- Tokenized {len(cache) - num_cached} new chunks/pieces ---")
+            print(f"--- Sized {len(refined_chunks)} chunks to {len(sized_chunks)} chunks of at most {max_tokens} tokens ---")
+            for chunk, num_tokens in over_limit:
+                print(f"Warning: Chunk of {num_tokens} tokens cannot be split further and will be truncated: {chunk[:60]!r}")
+
+            # Keep entries for the raw chunks (needed for sizing) and the final chunks (needed for embedding)
+            live = {chunk_hash(chunk) for chunk in refined_chunks + sized_chunks}
+            cache = {h: ids for h, ids in cache.items() if h in live}
+            save_token_cache(cache, info, token_cache_file)
+            print(f"--- Saved {len(cache)} tokenizations to {token_cache_file} ---")
+            refined_chunks = sized_chunks
+        except Exception as e:
+            print(f"Error sizing chunks by token length, keeping marker chunks: {e}")
+
     # Save chunks to a JSON file
     try:
         with open(output_file, "w", encoding="utf-8") as f:
@@ -47,7 +140,12 @@ def refine_chunks(input_file, output_file):
 # --- Configuration ---
 input_filename = "/home/ubuntu/lagrange_lab/preprocessed_math_marked_normalized.txt"
 output_filename = "/home/ubuntu/lagrange_lab/refined_chunks.json"
+# Token cache read by 07_embed_chunks.py; run this script before 07 so the cache matches the chunks
+token_cache_filename = "/home/ubuntu/lagrange_lab/chunk_tokens.npz"
+tokenizer_model_name = "tbs17/MathBERT"
+cache_directory = "/home/ubuntu/lagrange_lab/.cache"
+max_chunk_tokens = 512 # Capped at the tokenizer's model_max_length
 
 # --- Execute Chunk Refinement ---
-refine_chunks(input_filename, output_filename)
+refine_chunks(input_filename, output_filename, token_cache_filename, tokenizer_model_name, cache_directory, max_chunk_tokens)
 
@@ -2,9 +2,45 @@ import json
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import torch # Check if GPU is available
+from token_cache import chunk_hash, cache_matches, load_token_cache
 
-def embed_chunks(chunk_file, model_name, output_file):
-    """Loads chunks, embeds them using a SentenceTransformer model, and saves embeddings."""
+def encode_token_ids(model, token_ids, pad_id, batch_size=32):
+    """Embeds pre-tokenized inputs by feeding token ids straight to the model, skipping the tokenizer."""
+    max_len = model.max_seq_length or 512
+    # Truncate the same way the tokenizer would: keep the leading ids and the final [SEP]
+    token_ids = [ids if len(ids) <= max_len else np.append(ids[:max_len - 1], ids[-1]) for ids in token_ids]
+    # Batch similar lengths together to minimise padding, as model.encode does
+    order = np.argsort([-len(ids) for ids in token_ids], kind="stable")
+    embeddings = [None] * len(token_ids)
+    # Match model.encode, which disables dropout before running the model
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            width = max(len(token_ids[i]) for i in batch)
+            input_ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                input_ids[row, :len(token_ids[i])] = token_ids[i]
+                attention_mask[row, :len(token_ids[i])] = 1
+            features = {
+                "input_ids": torch.from_numpy(input_ids).to(model.device),
+                "attention_mask": torch.from_numpy(attention_mask).to(model.device),
+                "token_type_ids": torch.zeros((len(batch), width), dtype=torch.long, device=model.device),
+            }
+            output = model(features)["sentence_embedding"].cpu().numpy()
+            for row, i in enumerate(batch):
+                embeddings[i] = output[row]
+    return np.stack(embeddings)
+
+def embed_chunks(chunk_file, model_name, output_file, token_cache_file=None):
+    """Loads chunks, embeds them using a SentenceTransformer model, and saves embeddings.
+
+    Chunks found in the token cache written by 06_chunk_refined.py are embedded from
+    their cached token ids; only chunks missing from the cache go through the
+    tokenizer in model.encode. The cache is ignored if it was built with a different
+    tokenizer than model_name.
+    """
     print(f"--- Starting embedding process for {chunk_file} using {model_name} ---")
     
     # Load chunks
@@ -43,11 +79,33 @@ def embed_chunks(chunk_file, model_name, output_file):
         print(f"Error loading SentenceTransformer model {model_name}: {e}")
         return
 
+    # Load cached tokenizations
+    try:
+        token_cache, token_info = load_token_cache(token_cache_file)
+        if not cache_matches(token_info, model_name, model.tokenizer):
+            print("--- Ignoring token cache, all chunks will be tokenized ---")
+            token_cache = {}
+        elif token_cache:
+            print(f"--- Loaded {len(token_cache)} cached tokenizations from {token_cache_file} ---")
+            if model.max_seq_length and token_info["model_max_length"] > model.max_seq_length:
+                print(f"Warning: Chunks were sized for up to {token_info['model_max_length']} tokens but the model truncates at {model.max_seq_length}.")
+    except Exception as e:
+        print(f"Warning: Could not load token cache {token_cache_file}, tokenizing all chunks: {e}")
+        token_cache = {}
+
     # Generate embeddings
     try:
         print(f"--- Generating embeddings for {len(chunks)} chunks... ---")
-        # The encode method handles batching internally if needed
-        embeddings = model.encode(chunks, show_progress_bar=True)
+        cached_ids = [token_cache.get(chunk_hash(chunk)) for chunk in chunks]
+        cached = [i for i, ids in enumerate(cached_ids) if ids is not None]
+        uncached = [i for i, ids in enumerate(cached_ids) if ids is None]
+        print(f"--- {len(cached)} chunks use cached token ids, {len(uncached)} will be tokenized ---")
+        embeddings = np.zeros((len(chunks), model.get_sentence_embedding_dimension()), dtype=np.float32)
+        if cached:
+            embeddings[cached] = encode_token_ids(model, [cached_ids[i] for i in cached], token_info["pad_token_id"])
+        if uncached:
+            # The encode method handles batching internally if needed
+            embeddings[uncached] = model.encode([chunks[i] for i in uncached], show_progress_bar=True)
         print(f"--- Generated embeddings with shape: {embeddings.shape} ---")
         
         # Ensure embeddings are numpy array
@@ -72,7 +130,8 @@ def embed_chunks(chunk_file, model_name, output_file):
 chunk_filename = "/home/ubuntu/lagrange_lab/refined_chunks.json"
 embedding_model_name = "tbs17/MathBERT"
 output_embeddings_file = "/home/ubuntu/lagrange_lab/mathbert_embeddings.npy"
+token_cache_filename = "/home/ubuntu/lagrange_lab/chunk_tokens.npz"
 
 # --- Execute Embedding ---
-embed_chunks(chunk_filename, embedding_model_name, output_embeddings_file)
+embed_chunks(chunk_filename, embedding_model_name, output_embeddings_file, token_cache_filename)
 
@@ -1,10 +1,46 @@
 import json
+import math
+from collections import Counter
 import numpy as np
 import faiss
 import os
+from math_tokenizer import math_tokenize
 
-def build_faiss_index(embeddings_file, chunk_file, index_file, metadata_file):
-    """Loads embeddings and chunks, builds a FAISS index, and saves index and metadata."""
+def build_bm25_index(chunks, bm25_file, k1=1.5, b=0.75):
+    """Builds a BM25 inverted index over chunk text and saves it as JSON.
+
+    Postings store the precomputed BM25 weight of each term in each chunk, so a
+    query only needs to sum posting weights.
+    """
+    print(f"--- Building BM25 inverted index over {len(chunks)} chunks (k1={k1}, b={b}) ---")
+    doc_terms = [Counter(math_tokenize(chunk)) for chunk in chunks]
+    doc_lengths = [sum(terms.values()) for terms in doc_terms]
+    num_docs = len(chunks)
+    avg_length = (sum(doc_lengths) / num_docs) if num_docs else 0.0
+
+    doc_freq = Counter()
+    for terms in doc_terms:
+        doc_freq.update(terms.keys())
+
+    postings = {}
+    for doc_id, terms in enumerate(doc_terms):
+        norm = k1 * (1 - b + b * doc_lengths[doc_id] / avg_length) if avg_length else k1
+        for term, tf in terms.items():
+            idf = math.log(1 + (num_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            weight = idf * tf * (k1 + 1) / (tf + norm)
+            postings.setdefault(term, []).append([doc_id, round(weight, 6)])
+    print(f"--- BM25 index has {len(postings)} terms, average chunk length {avg_length:.1f} tokens ---")
+
+    bm25_index = {"k1": k1, "b": b, "num_docs": num_docs, "avg_length": avg_length, "postings": postings}
+    with open(bm25_file, 'w', encoding='utf-8') as f:
+        json.dump(bm25_index, f)
+    print(f"--- BM25 index saved to {bm25_file} ---")
+
+def build_faiss_index(embeddings_file, chunk_file, index_file, metadata_file, bm25_file=None):
+    """Loads embeddings and chunks, builds a FAISS index, and saves index and metadata.
+
+    If bm25_file is given, a BM25 inverted index over the same chunks is built alongside.
+    """
     print(f"--- Starting FAISS index construction from {embeddings_file} and {chunk_file} ---")
 
     # Load embeddings
@@ -80,12 +116,20 @@ def build_faiss_index(embeddings_file, chunk_file, index_file, metadata_file):
     except Exception as e:
         print(f"An unexpected error occurred saving metadata: {e}")
 
+    # Build lexical index alongside the vector index
+    if bm25_file:
+        try:
+            build_bm25_index(chunks, bm25_file)
+        except Exception as e:
+            print(f"Error building BM25 index: {e}")
+
 # --- Configuration ---
 embeddings_filename = "/home/ubuntu/lagrange_lab/mathbert_embeddings.npy"
 chunk_filename = "/home/ubuntu/lagrange_lab/refined_chunks.json"
 faiss_index_filename = "/home/ubuntu/lagrange_lab/math_vector_db.faiss"
 metadata_filename = "/home/ubuntu/lagrange_lab/chunk_metadata.json"
+bm25_index_filename = "/home/ubuntu/lagrange_lab/bm25_index.json"
 
 # --- Execute Index Building ---
-build_faiss_index(embeddings_filename, chunk_filename, faiss_index_filename, metadata_filename)
+build_faiss_index(embeddings_filename, chunk_filename, faiss_index_filename, metadata_filename, bm25_index_filename)
 
@@ -4,34 +4,26 @@ import faiss
 from sentence_transformers import SentenceTransformer
 import torch
 import os
+from math_tokenizer import math_tokenize
 
 # --- Configuration ---
 FAISS_INDEX_FILE = "/home/ubuntu/lagrange_lab/math_vector_db.faiss"
 METADATA_FILE = "/home/ubuntu/lagrange_lab/chunk_metadata.json"
 EMBEDDING_MODEL_NAME = "tbs17/MathBERT"
 CACHE_DIR = "/home/ubuntu/lagrange_lab/.cache"
+BM25_INDEX_FILE = "/home/ubuntu/lagrange_lab/bm25_index.json"
+RRF_K = 60 # Reciprocal rank fusion constant
+FUSION_DEPTH = 50 # Candidates taken from each ranker before fusion
 
 # --- Global Variables (Load once) ---
 INDEX = None
 METADATA = None
 MODEL = None
+BM25_INDEX = None
 
-def load_resources():
-    """Loads the FAISS index, metadata, and embedding model into global variables."""
-    global INDEX, METADATA, MODEL
-    
-    # Load FAISS index
-    if INDEX is None:
-        try:
-            print(f"--- Loading FAISS index from {FAISS_INDEX_FILE} ---")
-            INDEX = faiss.read_index(FAISS_INDEX_FILE)
-            print(f"--- FAISS index loaded. Total entries: {INDEX.ntotal} ---")
-        except Exception as e:
-            print(f"Error loading FAISS index: {e}")
-            INDEX = None # Ensure it's None if loading fails
-            return False
-            
-    # Load Metadata
+def load_metadata():
+    """Loads the chunk metadata into a global variable."""
+    global METADATA
     if METADATA is None:
         try:
             print(f"--- Loading metadata from {METADATA_FILE} ---")
@@ -54,6 +46,52 @@ def load_resources():
             print(f"An error occurred loading metadata: {e}")
             METADATA = None
             return False
+    return True
+
+def load_lexical_resources():
+    """Loads the BM25 index and metadata; does not load the embedding model."""
+    global BM25_INDEX
+    if not load_metadata():
+        return False
+
+    if BM25_INDEX is None:
+        try:
+            print(f"--- Loading BM25 index from {BM25_INDEX_FILE} ---")
+            with open(BM25_INDEX_FILE, "r", encoding="utf-8") as f:
+                BM25_INDEX = json.load(f)
+            print(f"--- BM25 index loaded. Terms: {len(BM25_INDEX['postings'])} ---")
+        except FileNotFoundError:
+            print(f"Error: BM25 index file {BM25_INDEX_FILE} not found.")
+            BM25_INDEX = None
+            return False
+        except Exception as e:
+            print(f"An error occurred loading BM25 index: {e}")
+            BM25_INDEX = None
+            return False
+
+    if BM25_INDEX["num_docs"] != len(METADATA["chunks"]):
+        print(f"Error: BM25 index size ({BM25_INDEX['num_docs']}) does not match metadata size ({len(METADATA['chunks'])}). Rebuild required.")
+        return False
+    return True
+
+def load_resources():
+    """Loads the FAISS index, metadata, and embedding model into global variables."""
+    global INDEX, MODEL
+    
+    # Load FAISS index
+    if INDEX is None:
+        try:
+            print(f"--- Loading FAISS index from {FAISS_INDEX_FILE} ---")
+            INDEX = faiss.read_index(FAISS_INDEX_FILE)
+            print(f"--- FAISS index loaded. Total entries: {INDEX.ntotal} ---")
+        except Exception as e:
+            print(f"Error loading FAISS index: {e}")
+            INDEX = None # Ensure it's None if loading fails
+            return False
+            
+    # Load Metadata
+    if not load_metadata():
+        return False
             
     # Load Embedding Model
     if MODEL is None:
@@ -78,39 +116,76 @@ def load_resources():
         print("--- Failed to load one or more resources. ---")
         return False
 
-def retrieve_relevant_chunks(query, k=1):
-    """Embeds a query and retrieves the top k relevant chunks."""
-    if not load_resources(): # Ensure resources are loaded
+def dense_search(query, k):
+    """Embeds a query with MathBERT and returns the indices of the top k chunks from FAISS."""
+    print(f"--- Embedding query: ", query[:100] + ("..." if len(query) > 100 else ""))
+    query_embedding = MODEL.encode([query]) # Encode expects a list
+    
+    # Ensure query embedding is float32 and 2D
+    if query_embedding.dtype != np.float32:
+        query_embedding = query_embedding.astype(np.float32)
+    if len(query_embedding.shape) == 1:
+         query_embedding = np.expand_dims(query_embedding, axis=0)
+         
+    print(f"--- Query embedding generated with shape: {query_embedding.shape} ---")
+
+    # Search the index
+    print(f"--- Searching FAISS index for top {k} results... ---")
+    distances, indices = INDEX.search(query_embedding, k)
+    print(f"--- Search complete. Indices: {indices}, Distances: {distances} ---")
+    return [int(idx) for idx in indices[0] if idx >= 0] if indices.size > 0 else []
+
+def lexical_search(query, k):
+    """Scores chunks against the query with the BM25 index and returns the indices of the top k."""
+    scores = {}
+    for term in math_tokenize(query):
+        for doc_id, weight in BM25_INDEX["postings"].get(term, ()):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight
+    ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))[:k]
+    print(f"--- BM25 search complete. Indices: {ranked}, Scores: {[round(scores[d], 3) for d in ranked]} ---")
+    return ranked
+
+def reciprocal_rank_fusion(rankings, k):
+    """Fuses ranked index lists by reciprocal rank fusion and returns the top k indices."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))[:k]
+
+def retrieve_relevant_chunks(query, k=1, mode="dense"):
+    """Retrieves the top k relevant chunks for a query.
+
+    mode is "dense" (MathBERT + FAISS), "lexical" (BM25 only, no encoder call),
+    or "hybrid" (both, fused by reciprocal rank fusion).
+    """
+    if mode not in ("dense", "lexical", "hybrid"):
+        return f"Error: Unknown retrieval mode '{mode}'."
+    if mode in ("lexical", "hybrid") and not load_lexical_resources():
+        return "Error: Could not load necessary resources for lexical retrieval."
+    if mode in ("dense", "hybrid") and not load_resources(): # Ensure resources are loaded
         return "Error: Could not load necessary resources for retrieval."
         
     if not isinstance(query, str) or not query:
         return "Error: Invalid query provided."
         
     try:
-        print(f"--- Embedding query: ", query[:100] + ("..." if len(query) > 100 else ""))
-        query_embedding = MODEL.encode([query]) # Encode expects a list
-        
-        # Ensure query embedding is float32 and 2D
-        if query_embedding.dtype != np.float32:
-            query_embedding = query_embedding.astype(np.float32)
-        if len(query_embedding.shape) == 1:
-             query_embedding = np.expand_dims(query_embedding, axis=0)
-             
-        print(f"--- Query embedding generated with shape: {query_embedding.shape} ---")
-
-        # Search the index
-        print(f"--- Searching FAISS index for top {k} results... ---")
-        distances, indices = INDEX.search(query_embedding, k)
-        print(f"--- Search complete. Indices: {indices}, Distances: {distances} ---")
+        if mode == "dense":
+            indices = dense_search(query, k)
+        elif mode == "lexical":
+            indices = lexical_search(query, k)
+        else:
+            depth = max(k, min(FUSION_DEPTH, len(METADATA["chunks"])))
+            indices = reciprocal_rank_fusion([dense_search(query, depth), lexical_search(query, depth)], k)
+            print(f"--- Fused dense and BM25 rankings. Indices: {indices} ---")
         
         # Retrieve chunks based on indices
         retrieved_chunks = []
-        if indices.size > 0:
-            for idx in indices[0]: # indices is 2D array [[idx1, idx2, ...]]
-                if 0 <= idx < len(METADATA["chunks"]):
-                    retrieved_chunks.append(METADATA["chunks"][idx])
-                else:
-                    print(f"Warning: Retrieved index {idx} is out of bounds.")
+        for idx in indices:
+            if 0 <= idx < len(METADATA["chunks"]):
+                retrieved_chunks.append(METADATA["chunks"][idx])
+            else:
+                print(f"Warning: Retrieved index {idx} is out of bounds.")
         
         print(f"--- Retrieved {len(retrieved_chunks)} chunks. ---")
         return "\n\n---\n\n".join(retrieved_chunks) # Join chunks with a separator
@@ -133,3 +208,13 @@ if __name__ == "__main__":
     print("\n--- Retrieval Result (Specific): ---")
     print(result_specific)
 
+    print(f"\n--- Testing lexical retrieval with specific query: ", test_query_specific)
+    result_lexical = retrieve_relevant_chunks(test_query_specific, k=1, mode="lexical")
+    print("\n--- Retrieval Result (Lexical): ---")
+    print(result_lexical)
+
+    print(f"\n--- Testing hybrid retrieval with specific query: ", test_query_specific)
+    result_hybrid = retrieve_relevant_chunks(test_query_specific, k=1, mode="hybrid")
+    print("\n--- Retrieval Result (Hybrid): ---")
+    print(result_hybrid)
+
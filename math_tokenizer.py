@@ -0,0 +1,58 @@
+import re
+
+# Tokenizer shared by 08_build_vector_db.py (BM25 index) and 09_retrieve_chunks.py (queries),
+# so index and query terms always match.
+
+# Unicode super/subscripts are rewritten as ^ / _ groups, e.g. x² -> x^2, x₁ -> x_1
+SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻", "0123456789+-")
+SUBSCRIPTS = str.maketrans("₀₁₂₃₄₅₆₇₈₉₊₋", "0123456789+-")
+SUPERSCRIPT_RUN = re.compile(r"[⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻]+")
+SUBSCRIPT_RUN = re.compile(r"[₀₁₂₃₄₅₆₇₈₉₊₋]+")
+
+# Greek letters are spelled out so λ_i and \lambda_i index to the same term
+GREEK_NAMES = {
+    "α": "alpha", "β": "beta", "γ": "gamma", "δ": "delta", "ε": "epsilon", "ζ": "zeta",
+    "η": "eta", "θ": "theta", "ι": "iota", "κ": "kappa", "λ": "lambda", "μ": "mu",
+    "ν": "nu", "ξ": "xi", "ο": "omicron", "π": "pi", "ρ": "rho", "σ": "sigma", "ς": "sigma",
+    "τ": "tau", "υ": "upsilon", "φ": "phi", "χ": "chi", "ψ": "psi", "ω": "omega",
+}
+GREEK_LETTER = re.compile("[" + "".join(GREEK_NAMES) + "]")
+
+# A sub/superscript is either a balanced {...} group or a signed unbraced run (x^2, x^-1)
+SCRIPT_GROUP = r"([_^])(\{[^{}]*\}|[+\-]?[a-z0-9]+)"
+SCRIPT_GROUP_PATTERN = re.compile(SCRIPT_GROUP)
+# Words, optionally with sub/superscripts (x^2, x^{n+1}, lambda_{i}), numbers, and math operators.
+# Nested groups such as x^{a^{2}} do not match as a whole, so only the head "x" is kept as a word.
+MATH_TOKEN_PATTERN = re.compile(r"[a-z]+(?:" + SCRIPT_GROUP + r")*|\d+(?:\.\d+)?|[=<>≤≥+\-*/^∇∂∑∫√]")
+# Single letters are never dropped, since in this corpus they are usually variables
+STOPWORDS = {"an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+             "of", "on", "or", "that", "the", "this", "to", "use", "we", "what", "with"}
+
+def normalize_math(text):
+    """Lowercases text and rewrites Unicode super/subscripts and Greek letters in ASCII form."""
+    text = text.lower()
+    text = SUPERSCRIPT_RUN.sub(lambda m: "^{" + m.group().translate(SUPERSCRIPTS) + "}", text)
+    text = SUBSCRIPT_RUN.sub(lambda m: "_{" + m.group().translate(SUBSCRIPTS) + "}", text)
+    # Pad Greek names so they don't merge into neighbouring letters (αβ, λx), then
+    # re-attach sub/superscripts so λ_i still becomes lambda_i
+    text = GREEK_LETTER.sub(lambda m: " " + GREEK_NAMES[m.group()] + " ", text)
+    return re.sub(r" *([_^]) *", r"\1", text)
+
+def math_tokenize(text):
+    """Splits text into word, number, and math-symbol tokens."""
+    tokens = []
+    for match in MATH_TOKEN_PATTERN.finditer(normalize_math(text)):
+        token = match.group()
+        if len(token) > 1 and token in STOPWORDS:
+            continue
+        groups = SCRIPT_GROUP_PATTERN.findall(token)
+        if not groups:
+            tokens.append(token)
+            continue
+        # Index the whole term (x^n+1), then its head and the contents of each group
+        # so a bare "x" or "n" still matches
+        tokens.append(re.sub(r"[{}\s]", "", token))
+        tokens.append(token[:SCRIPT_GROUP_PATTERN.search(token).start()])
+        for _, group in groups:
+            tokens.extend(math_tokenize(group.strip("{}")))
+    return tokens
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import numpy as np
+
+# Token cache shared by 06_chunk_refined.py (writes it) and 07_embed_chunks.py (reads it).
+# Token ids are stored as flat arrays (ids + offsets + lengths) keyed by chunk hash,
+# together with the tokenizer that produced them.
+
+def chunk_hash(chunk):
+    """Returns the SHA-1 hex digest used to key a chunk in the token cache."""
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()
+
+def load_tokenizer(model_name, cache_dir):
+    """Loads the fast tokenizer for model_name."""
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True, cache_dir=cache_dir)
+    if not tokenizer.is_fast:
+        print(f"Warning: No fast tokenizer available for {model_name}, using slow tokenizer.")
+    return tokenizer
+
+def tokenizer_info(model_name, tokenizer):
+    """Returns the tokenizer settings recorded alongside the cached ids."""
+    return {
+        "tokenizer_name": model_name,
+        "model_max_length": int(min(tokenizer.model_max_length, 2**31 - 1)),
+        "cls_token_id": -1 if tokenizer.cls_token_id is None else int(tokenizer.cls_token_id),
+        "sep_token_id": -1 if tokenizer.sep_token_id is None else int(tokenizer.sep_token_id),
+        "pad_token_id": -1 if tokenizer.pad_token_id is None else int(tokenizer.pad_token_id),
+    }
+
+def cache_matches(info, tokenizer_name, tokenizer):
+    """Returns True if a cache with the given info was built by this tokenizer; logs the mismatch otherwise."""
+    if info is None:
+        return True
+    expected = tokenizer_info(tokenizer_name, tokenizer)
+    mismatched = [key for key in expected if info.get(key) != expected[key]]
+    if mismatched:
+        print(f"--- Token cache does not match tokenizer {tokenizer_name} (differs in: {', '.join(mismatched)}) ---")
+        return False
+    return True
+
+def load_token_cache(cache_file):
+    """Loads the token cache as (chunk hash -> token id array, tokenizer info).
+
+    Returns ({}, None) if the file does not exist.
+    """
+    if not cache_file or not os.path.exists(cache_file):
+        return {}, None
+    data = np.load(cache_file)
+    hashes = data["hashes"]
+    offsets = data["offsets"]
+    ids = data["ids"]
+    info = {
+        "tokenizer_name": str(data["tokenizer_name"]),
+        "model_max_length": int(data["model_max_length"]),
+        "cls_token_id": int(data["cls_token_id"]),
+        "sep_token_id": int(data["sep_token_id"]),
+        "pad_token_id": int(data["pad_token_id"]),
+    }
+    cache = {h.decode("ascii"): ids[offsets[i]:offsets[i + 1]] for i, h in enumerate(hashes)}
+    return cache, info
+
+def save_token_cache(cache, info, cache_file):
+    """Saves a chunk hash -> token id mapping and its tokenizer info as an npz file."""
+    keys = sorted(cache)
+    lengths = np.array([len(cache[k]) for k in keys], dtype=np.int32)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if keys:
+        ids = np.concatenate([np.asarray(cache[k], dtype=np.int32) for k in keys])
+    else:
+        ids = np.zeros(0, dtype=np.int32)
+    hashes = np.array([k.encode("ascii") for k in keys], dtype="S40")
+    # np.savez appends .npz when missing, so write through a file handle
+    with open(cache_file, "wb") as f:
+        np.savez(f, hashes=hashes, offsets=offsets, lengths=lengths, ids=ids,
+                 tokenizer_name=np.array(info["tokenizer_name"]),
+                 model_max_length=np.int64(info["model_max_length"]),
+                 cls_token_id=np.int64(info["cls_token_id"]),
+                 sep_token_id=np.int64(info["sep_token_id"]),
+                 pad_token_id=np.int64(info["pad_token_id"]))
+
+def tokenize_missing(chunks, cache, tokenizer):
+    """Tokenizes the chunks not yet in the cache and adds them to it; returns how many were tokenized."""
+    pending = {}
+    for chunk in chunks:
+        h = chunk_hash(chunk)
+        if h not in cache and h not in pending:
+            pending[h] = chunk
+    if pending:
+        # Tokenize without truncation so stored lengths are the true chunk lengths
+        encoded = tokenizer(list(pending.values()), add_special_tokens=True, truncation=False)
+        for h, input_ids in zip(pending.keys(), encoded["input_ids"]):
+            cache[h] = np.asarray(input_ids, dtype=np.int32)
+    return len(pending)